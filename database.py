@@ -5,28 +5,83 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from redis.asyncio import Redis
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
+# Optional Redis used as a read-through cache (sessions, hot lookups)
+redis = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
+redis_url = os.getenv("REDIS_URL")
+
+def connect():
+    """Open the MongoDB and Redis clients.
+
+    Clients are not fork-safe, so call this from each worker's startup hook
+    rather than at import time.
+    """
+    global _client, db, redis
+    if database_url and database_name:
+        _client = AsyncIOMotorClient(database_url)
+        db = _client[database_name]
+    if redis_url:
+        redis = Redis.from_url(redis_url, decode_responses=True)
+    return db, redis
+
+async def disconnect():
+    """Close the clients opened by connect()"""
+    global _client, db, redis
+    if _client is not None:
+        _client.close()
+    if redis is not None:
+        await redis.aclose()
+    _client = db = redis = None
+
+async def _create_unique_index(collection, keys, **kwargs):
+    """Create a unique index, warning instead of failing startup if existing data has duplicates"""
+    try:
+        await collection.create_index(keys, unique=True, **kwargs)
+    except DuplicateKeyError as e:
+        logger.warning("Skipping unique index %r on %s: existing duplicates (%s)", keys, collection.name, e.details)
+
+async def ensure_indexes():
+    """Create the indexes backing the API's query shapes (idempotent)"""
+    if db is None:
+        return
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+    await _create_unique_index(db.attendancerecord, [("student_id", 1), ("date", 1), ("subject_code", 1)])
+    await db.academiccalendar.create_index([("date", 1), ("type", 1)])
+    await db.academiccalendar.create_index([("type", 1), ("date", -1)])
+    await db.teacherleave.create_index([("subject_code", 1), ("date", 1)])
+    await db.teacherleave.create_index("date")
+    # email/phone are stored as null when absent, so uniqueness only applies to real values
+    await _create_unique_index(db.student, "email", partialFilterExpression={"email": {"$type": "string"}})
+    await _create_unique_index(db.student, "phone", partialFilterExpression={"phone": {"$type": "string"}})
+    await db.session.create_index("token", unique=True)
+    await db.session.create_index("expires_at", expireAfterSeconds=0)
+    await _create_unique_index(db.subject, "code")
+    await db.subject.create_index("semester")
+    # One live OTP per phone; the prefix also serves the (phone, code) lookup in verify_otp
+    await _create_unique_index(db.otp, "phone")
+    await db.otp.create_index("expires_at", expireAfterSeconds=0)
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +95,26 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]], ordered: bool = True):
+    """Insert many documents with timestamps in one round-trip, returning the stored documents"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    await db[collection_name].insert_many(docs, ordered=ordered)
+    return docs
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +123,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
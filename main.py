@@ -1,16 +1,34 @@
-import os
-from datetime import datetime, timedelta, date as date_type
-from typing import List, Optional, Literal, Dict, Any
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, date as date_type
+from typing import Annotated, Any, Awaitable, Callable, Dict, List, Literal, Optional, Tuple
 import hashlib
-import random
-
-from fastapi import FastAPI, HTTPException, Header, Query
+import hmac
+import json
+import secrets
+import time
+
+import orjson
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, BeforeValidator, ConfigDict, EmailStr, Field, PlainSerializer, TypeAdapter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import db, redis, connect, disconnect, create_document, create_documents, ensure_indexes, get_documents
 
-from database import db, create_document, get_documents
+app = FastAPI(title="Attendance Tracker API", default_response_class=ORJSONResponse)
 
-app = FastAPI(title="Attendance Tracker API")
+# Added before CORS so CORS stays outermost and answers preflights uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,11 +38,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    global db, redis, cpu_pool
+    db, redis = connect()
+    # argon2-cffi releases the GIL, so a couple of threads per Gunicorn worker suffice
+    cpu_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cpu")
+    await ensure_indexes()
+
+@app.on_event("shutdown")
+async def shutdown():
+    global db, redis, cpu_pool
+    await disconnect()
+    db = redis = None
+    if cpu_pool is not None:
+        cpu_pool.shutdown()
+        cpu_pool = None
+
 # ----------------------------- Models -----------------------------
-class OTPRequest(BaseModel):
+def _d(d: date_type) -> int:
+    """Stored form of a calendar date: its proleptic Gregorian ordinal"""
+    return d.toordinal()
+
+# Dates are validated as dates but dumped as ordinals for storage
+OrdinalDate = Annotated[date_type, PlainSerializer(_d, return_type=int)]
+
+class APIModel(BaseModel):
+    # Unknown fields are dropped and handlers mutate payloads without re-validation
+    model_config = ConfigDict(extra="ignore", validate_assignment=False, defer_build=False)
+
+class OTPRequest(APIModel):
     phone: str
 
-class OTPVerify(BaseModel):
+class OTPVerify(APIModel):
     phone: str
     code: str
     name: Optional[str] = None
@@ -33,7 +79,7 @@ class OTPVerify(BaseModel):
     course: Optional[str] = None
     semester: Optional[int] = Field(None, ge=1, le=8)
 
-class RegisterEmail(BaseModel):
+class RegisterEmail(APIModel):
     name: str
     email: EmailStr
     password: str
@@ -41,47 +87,141 @@ class RegisterEmail(BaseModel):
     course: str
     semester: int = Field(..., ge=1, le=8)
 
-class LoginEmail(BaseModel):
+class LoginEmail(APIModel):
     email: EmailStr
     password: str
 
-class SubjectIn(BaseModel):
+class SubjectIn(APIModel):
     code: str
     name: str
     semester: int = Field(..., ge=1, le=8)
 
-class AcademicEventIn(BaseModel):
+class AcademicEventIn(APIModel):
     title: str
-    date: date_type
+    date: OrdinalDate
     type: Literal["holiday", "event", "semester_start", "semester_end"] = "holiday"
 
-class TeacherLeaveIn(BaseModel):
+class TeacherLeaveIn(APIModel):
     subject_code: str
-    date: date_type
+    date: OrdinalDate
     reason: Optional[str] = None
 
-class StudentUpdate(BaseModel):
+class StudentUpdate(APIModel):
     name: Optional[str] = None
     semester: Optional[int] = Field(None, ge=1, le=8)
     course: Optional[str] = None
     subjects: Optional[List[str]] = None
     min_threshold: Optional[float] = Field(None, ge=0, le=1)
 
-class AttendanceMark(BaseModel):
+class AttendanceMark(APIModel):
     student_id: str
     subject_code: str
-    date: date_type
+    date: OrdinalDate
     sessions_held: int = 1
     attended_count: int = 0
     status: Literal["attended", "not_attended", "teacher_leave", "holiday", "mixed"] = "mixed"
 
+class StudentOut(APIModel):
+    id: Annotated[str, BeforeValidator(str)] = Field(validation_alias="_id")
+    name: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    role: str = "student"
+    course: Optional[str] = None
+    semester: Optional[int] = None
+    subjects: List[str] = []
+    min_threshold: float = 0.67
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+_STUDENT_OUT = TypeAdapter(StudentOut)
+
 # ----------------------------- Helpers -----------------------------
 
 def now_utc() -> datetime:
     return datetime.utcnow()
 
+ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+SESSION_TTL = 3600
+CACHE_TTL = 86400
+# Six-digit OTPs: 100000-999999
+_OTP_RANGE = 900000
+
+# Thread pool for CPU-bound work (argon2), created per worker at startup
+cpu_pool: Optional[ThreadPoolExecutor] = None
+
+# Cursor batch sizes sized to each query's expected result count
+_DAY_BATCH = 32
+_SUBJECT_BATCH = 64
+_STATS_BATCH = 256
+
+# Credentials never leave the server
+_STUDENT_PUBLIC_PROJ = {"password_hash": 0}
+
+
 def hash_password(pw: str) -> str:
-    return hashlib.sha256(pw.encode()).hexdigest()
+    return ph.hash(pw)
+
+
+def verify_password(stored: Optional[str], pw: str) -> bool:
+    if not stored:
+        return False
+    if not stored.startswith("$argon2"):
+        # legacy unsalted sha256 digest, upgraded on next successful login
+        return hmac.compare_digest(stored, hashlib.sha256(pw.encode()).hexdigest())
+    try:
+        return ph.verify(stored, pw)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any):
+    """Run CPU-bound work off the event loop; falls back to the default thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, fn, *args)
+
+
+async def cache_session(token: str, student: Dict[str, Any], ttl: int):
+    """Cache the public student for a session so authenticated calls are one Redis GET"""
+    if redis is None or ttl <= 0:
+        return
+    await redis.setex(f"session:{token}", ttl, json.dumps(student))
+    # Lets profile updates drop every cached copy of that student
+    await redis.sadd(f"student_sessions:{student['id']}", token)
+    await redis.expire(f"student_sessions:{student['id']}", SESSION_TTL)
+
+
+async def forget_cached_sessions(student_id: str):
+    if redis is None:
+        return
+    tokens = await redis.smembers(f"student_sessions:{student_id}")
+    if tokens:
+        await redis.delete(*(f"session:{t}" for t in tokens))
+
+
+async def issue_session(student: Dict[str, Any]) -> str:
+    token = secrets.token_urlsafe(32)
+    # One document per session, so each device keeps its own token; the TTL index on expires_at removes it
+    await create_document("session", {"token": token, "student_id": str(student["_id"]), "expires_at": now_utc() + timedelta(seconds=SESSION_TTL)})
+    await cache_session(token, serialize_student(student), SESSION_TTL)
+    return token
+
+
+async def get_current_student(token: str = Header(...)) -> Dict[str, Any]:
+    """Resolve a session token to the public (serialized) student"""
+    ensure_db()
+    cached_student = await redis.get(f"session:{token}") if redis is not None else None
+    if cached_student is not None:
+        return json.loads(cached_student)
+    now = now_utc()
+    session = await db.session.find_one({"token": token, "expires_at": {"$gt": now}}, {"student_id": 1, "expires_at": 1})
+    s = await db.student.find_one(_to_id_filter(session["student_id"]), _STUDENT_PUBLIC_PROJ) if session else None
+    if not s:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    student = serialize_student(s)
+    # Never cache past the session's own expiry
+    await cache_session(token, student, int((session["expires_at"] - now).total_seconds()))
+    return student
 
 
 def ensure_db():
@@ -89,29 +229,125 @@ def ensure_db():
         raise HTTPException(status_code=500, detail="Database not configured")
 
 
-def get_student_by_email(email: str):
+def _to_id_filter(student_id: str) -> Dict[str, Any]:
+    try:
+        return {"_id": ObjectId(student_id)}
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=404, detail="Not found")
+
+
+async def create_student(doc: Dict[str, Any]) -> str:
+    """Insert a student, mapping unique email/phone violations to a 400"""
+    try:
+        return await create_document("student", doc)
+    except DuplicateKeyError as e:
+        field = next(iter((e.details or {}).get("keyPattern") or {}), None)
+        detail = f"{field.capitalize()} already registered" if field else "Already registered"
+        raise HTTPException(status_code=400, detail=detail)
+
+
+async def get_student_by_email(email: str, projection: Optional[Dict[str, Any]] = None):
     ensure_db()
-    return db.student.find_one({"email": email})
+    return await db.student.find_one({"email": email}, projection)
 
 
-def get_student_by_phone(phone: str):
+async def get_student_by_phone(phone: str, projection: Optional[Dict[str, Any]] = None):
     ensure_db()
-    return db.student.find_one({"phone": phone})
+    return await db.student.find_one({"phone": phone}, projection)
+
+
+# Aggregation stages that emit `id` as a string instead of `_id`, so listings skip serialize()
+_ID_AS_STRING = [{"$addFields": {"id": {"$toString": "$_id"}}}, {"$project": {"_id": 0}}]
+
+_EPOCH_ORDINAL = date_type(1970, 1, 1).toordinal()
+
+# Aggregation stage rendering a stored ordinal `date` back to "YYYY-MM-DD" for responses
+_DATE_AS_STRING = {"$addFields": {"date": {"$dateToString": {
+    "format": "%Y-%m-%d",
+    "date": {"$toDate": {"$multiply": [{"$subtract": ["$date", _EPOCH_ORDINAL]}, 86400000]}},
+}}}}
 
 
 def serialize(doc: Dict[str, Any]):
     if not doc:
         return doc
-    doc["id"] = str(doc.pop("_id"))
+    doc["id"] = str(doc["_id"])
+    del doc["_id"]
     return doc
 
+
+def serialize_student(doc: Optional[Dict[str, Any]]):
+    if not doc:
+        return doc
+    return _STUDENT_OUT.dump_python(_STUDENT_OUT.validate_python(doc), mode="json")
+
+
+async def _versioned(key: str) -> str:
+    """Current generation of a cache key.
+
+    invalidate() bumps the generation instead of deleting, so a load that
+    started before an admin write can only populate the superseded key.
+    """
+    return f"{key}@{await redis.get(f'ver:{key}') or 0}"
+
+
+async def cached(key: str, ttl: int, loader: Callable[[], Awaitable[Any]]):
+    """Read-through Redis cache; values are stored as JSON"""
+    if redis is None:
+        return await loader()
+    key = await _versioned(key)
+    v = await redis.get(key)
+    if v is not None:
+        return json.loads(v)
+    v = await loader()
+    await redis.setex(key, ttl, json.dumps(jsonable_encoder(v)))
+    return v
+
+
+async def invalidate(*keys: str):
+    if redis is not None:
+        for key in keys:
+            await redis.incr(f"ver:{key}")
+
+
+def render_etagged(payload: Any) -> str:
+    """Render a JSON body as a cache entry: its quoted ETag, a newline, then the body"""
+    body = orjson.dumps(jsonable_encoder(payload)).decode()
+    return f'"{hashlib.blake2b(body.encode(), digest_size=16).hexdigest()}"\n{body}'
+
+
+def etag_reply(request: Request, entry: str) -> Response:
+    """Answer with the entry's body, or 304 when If-None-Match already has its tag"""
+    tag, body = entry.split("\n", 1)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or tag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers={"ETag": tag})
+    return Response(body, media_type="application/json", headers={"ETag": tag})
+
+
+async def etag_response(request: Request, key: str, field: str, loader: Callable[[], Awaitable[Any]]) -> Response:
+    """Serve a JSON body with an ETag, answering a matching If-None-Match with 304.
+
+    The rendered body and its tag are cached in the Redis hash for the
+    current generation of `key` under `field`, so invalidating a whole
+    listing is a single invalidate(key).
+    """
+    hkey = await _versioned(key) if redis is not None else None
+    entry = await redis.hget(hkey, field) if hkey is not None else None
+    if entry is None:
+        entry = render_etagged(await loader())
+        if hkey is not None:
+            await redis.hset(hkey, field, entry)
+            await redis.expire(hkey, CACHE_TTL)
+    return etag_reply(request, entry)
+
 # ----------------------------- Basic -----------------------------
 @app.get("/")
-def root():
+async def root():
     return {"status": "ok", "service": "attendance-tracker"}
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "running",
         "database": "connected" if db is not None else "not_configured",
@@ -119,244 +355,355 @@ def test_database():
     }
     if db is not None:
         try:
-            response["collections"] = db.list_collection_names()
+            response["collections"] = await db.list_collection_names()
         except Exception as e:
             response["error"] = str(e)
     return response
 
 # ----------------------------- Auth -----------------------------
 @app.post("/auth/request-otp")
-def request_otp(payload: OTPRequest):
+async def request_otp(payload: OTPRequest):
     ensure_db()
-    code = f"{random.randint(100000, 999999)}"
-    expires = now_utc() + timedelta(minutes=5)
-    db.otp.delete_many({"phone": payload.phone})
-    create_document("otp", {"phone": payload.phone, "code": code, "expires_at": expires})
+    code = f"{secrets.randbelow(_OTP_RANGE) + 100000:06d}"
+    now = now_utc()
+    expires = now + timedelta(minutes=5)
+    # One OTP per phone; the TTL index on expires_at removes stale ones
+    await db.otp.update_one(
+        {"phone": payload.phone},
+        {"$set": {"code": code, "expires_at": expires, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+        upsert=True,
+    )
     return {"sent": True, "dev_code": code}
 
 @app.post("/auth/verify-otp")
-def verify_otp(payload: OTPVerify):
+async def verify_otp(payload: OTPVerify):
     ensure_db()
-    rec = db.otp.find_one({"phone": payload.phone, "code": payload.code})
+    # Consume the code atomically so it can only be redeemed once
+    rec = await db.otp.find_one_and_delete({"phone": payload.phone, "code": payload.code})
     if not rec:
         raise HTTPException(status_code=400, detail="Invalid code")
     if rec.get("expires_at") and rec["expires_at"] < now_utc():
         raise HTTPException(status_code=400, detail="Code expired")
-    student = get_student_by_phone(payload.phone)
+    student = await get_student_by_phone(payload.phone, _STUDENT_PUBLIC_PROJ)
     if not student:
+        password_hash = await run_cpu(hash_password, payload.password) if payload.password else None
         doc = {
             "name": payload.name or "Student",
             "email": payload.email,
             "phone": payload.phone,
-            "password_hash": hash_password(payload.password) if payload.password else None,
+            "password_hash": password_hash,
             "role": "student",
             "course": payload.course,
             "semester": payload.semester,
             "subjects": [],
             "min_threshold": 0.67,
         }
-        new_id = create_document("student", doc)
-        student = db.student.find_one({"_id": db.ObjectId(new_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"phone": payload.phone})
-    db.otp.delete_many({"phone": payload.phone})
-    return {"token": str(student.get("_id")), "student": serialize(student)}
+        new_id = await create_student(doc)
+        student = await db.student.find_one(_to_id_filter(new_id), _STUDENT_PUBLIC_PROJ)
+    token = await issue_session(student)
+    return {"token": token, "student": serialize_student(student)}
 
 @app.post("/auth/register-email")
-def register_email(payload: RegisterEmail):
+async def register_email(payload: RegisterEmail):
     ensure_db()
-    if get_student_by_email(payload.email):
+    if await get_student_by_email(payload.email, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Email already registered")
     doc = {
         "name": payload.name,
         "email": payload.email,
         "phone": payload.phone,
-        "password_hash": hash_password(payload.password),
+        "password_hash": await run_cpu(hash_password, payload.password),
         "role": "student",
         "course": payload.course,
         "semester": payload.semester,
         "subjects": [],
         "min_threshold": 0.67,
     }
-    new_id = create_document("student", doc)
-    s = db.student.find_one({"_id": db.ObjectId(new_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"email": payload.email})
-    return {"token": str(s.get("_id")), "student": serialize(s)}
+    new_id = await create_student(doc)
+    s = await db.student.find_one(_to_id_filter(new_id), _STUDENT_PUBLIC_PROJ)
+    token = await issue_session(s)
+    return {"token": token, "student": serialize_student(s)}
 
 @app.post("/auth/login-email")
-def login_email(payload: LoginEmail):
+async def login_email(payload: LoginEmail):
     ensure_db()
-    s = get_student_by_email(payload.email)
-    if not s or s.get("password_hash") != hash_password(payload.password):
+    s = await get_student_by_email(payload.email)
+    if not s or not await run_cpu(verify_password, s.get("password_hash"), payload.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"token": str(s.get("_id")), "student": serialize(s)}
+    stored = s.pop("password_hash")
+    if not stored.startswith("$argon2") or ph.check_needs_rehash(stored):
+        await db.student.update_one({"_id": s["_id"]}, {"$set": {"password_hash": await run_cpu(hash_password, payload.password)}})
+    token = await issue_session(s)
+    return {"token": token, "student": serialize_student(s)}
+
+@app.get("/auth/me")
+async def auth_me(student: Dict[str, Any] = Depends(get_current_student)):
+    return {"student": student}
 
 # ----------------------------- Metadata -----------------------------
+# Constant response: rendered and tagged once at import
+_SEMESTERS_ENTRY = render_etagged({"semesters": list(range(1, 9))})
+
 @app.get("/semesters")
-def semesters():
-    return {"semesters": list(range(1, 9))}
+async def semesters(request: Request):
+    return etag_reply(request, _SEMESTERS_ENTRY)
 
 @app.post("/admin/subjects")
-def admin_add_subject(subj: SubjectIn):
+async def admin_add_subject(subj: SubjectIn):
     ensure_db()
-    if db.subject.find_one({"code": subj.code}):
+    if await db.subject.find_one({"code": subj.code}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Subject code exists")
-    create_document("subject", subj.model_dump())
+    await create_document("subject", subj.model_dump())
+    await invalidate("subjects")
     return {"ok": True}
 
 @app.get("/subjects")
-def list_subjects(semester: int = Query(..., ge=1, le=8)):
+async def list_subjects(request: Request, semester: int = Query(..., ge=1, le=8)):
     ensure_db()
-    items = list(db.subject.find({"semester": semester}))
-    return {"subjects": [serialize(i) for i in items]}
+
+    async def load():
+        items = await db.subject.aggregate([{"$match": {"semester": semester}}, *_ID_AS_STRING], batchSize=_SUBJECT_BATCH).to_list(length=None)
+        return {"subjects": items}
+
+    return await etag_response(request, "subjects", str(semester), load)
 
 @app.post("/admin/calendar")
-def admin_add_calendar(event: AcademicEventIn):
+async def admin_add_calendar(event: AcademicEventIn):
     ensure_db()
-    create_document("academiccalendar", event.model_dump())
+    await create_document("academiccalendar", event.model_dump())
+    await invalidate(f"hol:{event.date.isoformat()}", "calendar")
     return {"ok": True}
 
 @app.get("/calendar")
-def get_calendar(frm: Optional[date_type] = None, to: Optional[date_type] = None):
+async def get_calendar(request: Request, frm: Optional[date_type] = None, to: Optional[date_type] = None):
     ensure_db()
-    q: Dict[str, Any] = {}
-    if frm or to:
-        q["date"] = {}
-        if frm:
-            q["date"]["$gte"] = frm
-        if to:
-            q["date"]["$lte"] = to
-    items = list(db.academiccalendar.find(q))
-    return {"events": [serialize(i) for i in items]}
+
+    async def load():
+        q: Dict[str, Any] = {}
+        if frm or to:
+            q["date"] = {}
+            if frm:
+                q["date"]["$gte"] = _d(frm)
+            if to:
+                q["date"]["$lte"] = _d(to)
+        items = await db.academiccalendar.aggregate([{"$match": q}, _DATE_AS_STRING, *_ID_AS_STRING]).to_list(length=None)
+        return {"events": items}
+
+    return await etag_response(request, "calendar", f"{frm}:{to}", load)
 
 @app.post("/admin/teacher-leave")
-def admin_teacher_leave(tl: TeacherLeaveIn):
+async def admin_teacher_leave(tl: TeacherLeaveIn):
     ensure_db()
-    create_document("teacherleave", tl.model_dump())
+    await create_document("teacherleave", tl.model_dump())
+    await invalidate("teacherleave")
     return {"ok": True}
 
 @app.get("/teacher-leave")
-def get_teacher_leave(subject_code: Optional[str] = None, d: Optional[date_type] = None):
+async def get_teacher_leave(request: Request, subject_code: Optional[str] = None, d: Optional[date_type] = None):
     ensure_db()
-    q: Dict[str, Any] = {}
-    if subject_code:
-        q["subject_code"] = subject_code
-    if d:
-        q["date"] = d
-    items = list(db.teacherleave.find(q))
-    return {"items": [serialize(i) for i in items]}
+
+    async def load():
+        q: Dict[str, Any] = {}
+        if subject_code:
+            q["subject_code"] = subject_code
+        if d:
+            q["date"] = _d(d)
+        items = await db.teacherleave.aggregate([{"$match": q}, _DATE_AS_STRING, *_ID_AS_STRING]).to_list(length=None)
+        return {"items": items}
+
+    return await etag_response(request, "teacherleave", f"{subject_code}:{d}", load)
 
 # ----------------------------- Student Profile -----------------------------
 @app.put("/student/{student_id}")
-def update_student(student_id: str, payload: StudentUpdate):
+async def update_student(student_id: str, payload: StudentUpdate):
     ensure_db()
     update = {k: v for k, v in payload.model_dump(exclude_none=True).items()}
-    db.student.update_one({"_id": db.ObjectId(student_id) if hasattr(db, 'ObjectId') else {"id": student_id}}, {"$set": update})
-    s = db.student.find_one({"_id": db.ObjectId(student_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"id": student_id})
-    return {"student": serialize(s)}
+    id_filter = _to_id_filter(student_id)
+    await db.student.update_one(id_filter, {"$set": update})
+    await forget_cached_sessions(student_id)
+    s = await db.student.find_one(id_filter, _STUDENT_PUBLIC_PROJ)
+    return {"student": serialize_student(s)}
 
 @app.get("/student/{student_id}")
-def get_student(student_id: str):
+async def get_student(student_id: str):
     ensure_db()
-    s = db.student.find_one({"_id": db.ObjectId(student_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"id": student_id})
+    s = await db.student.find_one(_to_id_filter(student_id), _STUDENT_PUBLIC_PROJ)
     if not s:
         raise HTTPException(status_code=404, detail="Not found")
-    return {"student": serialize(s)}
+    return {"student": serialize_student(s)}
 
 # ----------------------------- Attendance -----------------------------
 
-def is_holiday(d: date_type) -> bool:
-    return db.academiccalendar.find_one({"date": d, "type": "holiday"}) is not None
+async def is_holiday(d: date_type) -> bool:
+    async def load():
+        return await db.academiccalendar.find_one({"date": _d(d), "type": "holiday"}, {"_id": 1}) is not None
 
-def is_teacher_leave(subject_code: str, d: date_type) -> bool:
-    return db.teacherleave.find_one({"subject_code": subject_code, "date": d}) is not None
+    return await cached(f"hol:{d.isoformat()}", CACHE_TTL, load)
 
 @app.get("/attendance/day")
-def attendance_day(student_id: str, d: date_type):
+async def attendance_day(student_id: str, d: date_type):
     ensure_db()
     # Auto-mark as holiday for past days with no status at end of day
     today = datetime.utcnow().date()
-    s = db.student.find_one({"_id": db.ObjectId(student_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"id": student_id})
-    subs = s.get("subjects", []) if s else []
-    if d < today and not is_holiday(d):
-        for code in subs:
-            if not is_teacher_leave(code, d):
-                q = {"student_id": student_id, "subject_code": code, "date": d}
-                if not db.attendancerecord.find_one(q):
-                    create_document("attendancerecord", {"student_id": student_id, "subject_code": code, "date": d, "sessions_held": 0, "attended_count": 0, "status": "holiday"})
-
-    records = list(db.attendancerecord.find({"student_id": student_id, "date": d}))
+    day = _d(d)
+    # Student subjects, holiday flag, teacher leaves and records in one round-trip
+    pipeline = [
+        {"$match": _to_id_filter(student_id)},
+        {"$project": {"subjects": {"$ifNull": ["$subjects", []]}}},
+        {"$lookup": {
+            "from": "academiccalendar",
+            "pipeline": [{"$match": {"date": day, "type": "holiday"}}, {"$limit": 1}, {"$project": {"_id": 1}}],
+            "as": "holiday",
+        }},
+        {"$lookup": {
+            "from": "teacherleave",
+            "let": {"subs": "$subjects"},
+            "pipeline": [
+                {"$match": {"date": day, "$expr": {"$in": ["$subject_code", "$$subs"]}}},
+                {"$project": {"_id": 0, "subject_code": 1}},
+            ],
+            "as": "leaves",
+        }},
+        {"$lookup": {
+            "from": "attendancerecord",
+            "pipeline": [{"$match": {"student_id": student_id, "date": day}}, _DATE_AS_STRING, *_ID_AS_STRING],
+            "as": "records",
+        }},
+    ]
+    joined = await db.student.aggregate(pipeline).to_list(length=1)
+    if not joined:
+        # records are joined onto the student, so an unknown student can't be answered with an empty day
+        raise HTTPException(status_code=404, detail="Not found")
+    s = joined[0]
+    subs = s.get("subjects", [])
+    holiday = bool(s.get("holiday"))
+    leaves = {tl["subject_code"] for tl in s.get("leaves", [])}
+    records = s.get("records", [])
+    if d < today and not holiday:
+        marked = {r["subject_code"] for r in records}
+        missing = [
+            {"student_id": student_id, "subject_code": code, "date": day, "sessions_held": 0, "attended_count": 0, "status": "holiday"}
+            for code in subs if code not in leaves and code not in marked
+        ]
+        if missing:
+            try:
+                for r in await create_documents("attendancerecord", missing, ordered=False):
+                    r["date"] = d.isoformat()
+                    records.append(serialize(r))
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+                # A concurrent request stored some of these first; return what is persisted
+                records = await db.attendancerecord.aggregate(
+                    [{"$match": {"student_id": student_id, "date": day}}, _DATE_AS_STRING, *_ID_AS_STRING],
+                    batchSize=_DAY_BATCH,
+                ).to_list(length=None)
+
     # Suggest defaults
     suggestions: Dict[str, str] = {}
     for code in subs:
-        if is_holiday(d):
+        if holiday:
             suggestions[code] = "holiday"
-        elif is_teacher_leave(code, d):
+        elif code in leaves:
             suggestions[code] = "teacher_leave"
     return {
-        "records": [serialize(r) for r in records],
+        "records": records,
         "suggestions": suggestions
     }
 
+async def mark_attendance(payloads: List[AttendanceMark]):
+    if not payloads:
+        return
+    # Prefetch holidays (cached per date) and the batch's teacher leaves in one query
+    dates = {p.date for p in payloads}
+    holidays = {d for d in dates if await is_holiday(d)}
+    leave_docs = await db.teacherleave.find(
+        {"subject_code": {"$in": list({p.subject_code for p in payloads})}, "date": {"$in": [_d(x) for x in dates]}},
+        {"_id": 0, "subject_code": 1, "date": 1},
+    ).batch_size(_DAY_BATCH).to_list(length=None)
+    leaves = {(tl["subject_code"], tl["date"]) for tl in leave_docs}
+
+    now = datetime.now(timezone.utc)
+    ops = []
+    for payload in payloads:
+        # Normalize based on calendar and teacher leave if status not explicitly set
+        if payload.date in holidays:
+            payload.status = "holiday"
+            payload.sessions_held = max(payload.sessions_held, 1)
+            payload.attended_count = 0
+        elif (payload.subject_code, _d(payload.date)) in leaves:
+            payload.status = "teacher_leave"
+            payload.attended_count = 0
+        # Upsert by (student_id, subject_code, date)
+        q = {"student_id": payload.student_id, "subject_code": payload.subject_code, "date": _d(payload.date)}
+        ops.append(UpdateOne(q, {"$set": {**payload.model_dump(), "updated_at": now}, "$setOnInsert": {"created_at": now}}, upsert=True))
+    await db.attendancerecord.bulk_write(ops, ordered=False)
+
 @app.post("/attendance/mark")
-def attendance_mark(payload: AttendanceMark):
+async def attendance_mark(payload: AttendanceMark):
     ensure_db()
-    # Normalize based on calendar and teacher leave if status not explicitly set
-    if is_holiday(payload.date):
-        payload.status = "holiday"
-        payload.sessions_held = max(payload.sessions_held, 1)
-        payload.attended_count = 0
-    elif is_teacher_leave(payload.subject_code, payload.date):
-        payload.status = "teacher_leave"
-        payload.attended_count = 0
-    # Upsert by (student_id, subject_code, date)
-    q = {"student_id": payload.student_id, "subject_code": payload.subject_code, "date": payload.date}
-    doc = db.attendancerecord.find_one(q)
-    body = payload.model_dump()
-    if doc:
-        db.attendancerecord.update_one(q, {"$set": body})
-    else:
-        create_document("attendancerecord", body)
+    await mark_attendance([payload])
     return {"ok": True}
 
+@app.post("/attendance/mark-bulk")
+async def attendance_mark_bulk(payloads: List[AttendanceMark]):
+    ensure_db()
+    await mark_attendance(payloads)
+    return {"ok": True, "count": len(payloads)}
+
+_PERIOD_START: Dict[str, Callable[[date_type], date_type]] = {
+    "weekly": lambda t: t - timedelta(days=t.weekday()),
+    "monthly": lambda t: t.replace(day=1),
+}
+
+# (expires_at, value) for the latest semester_start; per worker, refreshed hourly
+_semester_start_cache: Tuple[float, Optional[date_type]] = (0.0, None)
+
+async def semester_start() -> Optional[date_type]:
+    global _semester_start_cache
+    expires_at, value = _semester_start_cache
+    if time.monotonic() < expires_at:
+        return value
+    doc = await db.academiccalendar.find_one({"type": "semester_start"}, {"date": 1}, sort=[("date", -1)])
+    value = date_type.fromordinal(doc["date"]) if doc else None
+    _semester_start_cache = (time.monotonic() + 3600, value)
+    return value
+
 @app.get("/attendance/stats")
-def attendance_stats(student_id: str, period: Literal["weekly", "monthly", "semester"] = "weekly"):
+async def attendance_stats(student_id: str, period: Literal["weekly", "monthly", "semester"] = "weekly"):
     ensure_db()
     today = datetime.utcnow().date()
-    if period == "weekly":
-        start = today - timedelta(days=today.weekday())
-    elif period == "monthly":
-        start = today.replace(day=1)
+    if period != "semester":
+        start = _PERIOD_START[period](today)
     else:
         # attempt to use academic calendar semester_start if present
-        sem_start = db.academiccalendar.find_one({"type": "semester_start"}, sort=[("date", -1)])
-        start = sem_start["date"] if sem_start else today.replace(day=1)
-    q = {"student_id": student_id, "date": {"$gte": start, "$lte": today}}
-    recs = list(db.attendancerecord.find(q))
+        start = await semester_start() or today.replace(day=1)
+    q = {"student_id": student_id, "date": {"$gte": _d(start), "$lte": _d(today)}}
+    pipeline = [
+        # holidays and teacher_leave don't count
+        {"$match": {**q, "status": {"$nin": ["holiday", "teacher_leave"]}}},
+        {"$group": {
+            "_id": "$subject_code",
+            "attended": {"$sum": {"$ifNull": ["$attended_count", 0]}},
+            "held": {"$sum": {"$ifNull": ["$sessions_held", 1]}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    per_subject = await db.attendancerecord.aggregate(pipeline, batchSize=_STATS_BATCH).to_list(length=None)
 
-    per_subject: Dict[str, Dict[str, float]] = {}
     total_attended = 0
     total_held = 0
-    for r in recs:
-        code = r["subject_code"]
-        status = r.get("status")
-        sessions = int(r.get("sessions_held", 1))
-        attended = int(r.get("attended_count", 0))
-        # holidays and teacher_leave don't count
-        if status in ("holiday", "teacher_leave"):
-            continue
-        total_held += sessions
-        total_attended += attended
-        if code not in per_subject:
-            per_subject[code] = {"attended": 0, "held": 0}
-        per_subject[code]["attended"] += attended
-        per_subject[code]["held"] += sessions
-
     subject_stats = []
-    for code, vals in per_subject.items():
-        pct = (vals["attended"] / vals["held"] * 100) if vals["held"] > 0 else 0.0
-        subject_stats.append({"subject_code": code, "attended": vals["attended"], "held": vals["held"], "percentage": round(pct, 2)})
+    for g in per_subject:
+        attended, held = int(g["attended"]), int(g["held"])
+        total_attended += attended
+        total_held += held
+        pct = (attended / held * 100) if held > 0 else 0.0
+        subject_stats.append({"subject_code": g["_id"], "attended": attended, "held": held, "percentage": round(pct, 2)})
 
     overall_pct = (total_attended / total_held * 100) if total_held > 0 else 0.0
     # include threshold
-    s = db.student.find_one({"_id": db.ObjectId(student_id)}) if hasattr(db, 'ObjectId') else db.student.find_one({"id": student_id})
+    s = await db.student.find_one(_to_id_filter(student_id), {"min_threshold": 1})
     threshold = float(s.get("min_threshold", 0.67)) * 100 if s else 67.0
     alert = overall_pct < threshold
 
@@ -367,8 +714,3 @@ def attendance_stats(student_id: str, period: Literal["weekly", "monthly", "seme
         "overall": {"attended": total_attended, "held": total_held, "percentage": round(overall_pct, 2), "threshold": threshold, "alert": alert},
         "subjects": subject_stats
     }
-
-if __name__ == "__main__":
-    import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
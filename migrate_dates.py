@@ -0,0 +1,34 @@
+"""
+One-time Date Migration
+
+Rewrites BSON datetime `date` fields in academiccalendar, teacherleave and
+attendancerecord to `date.toordinal()` integers, the form the API stores and
+queries. Safe to re-run: documents already holding ordinals are skipped.
+
+Usage: python migrate_dates.py
+"""
+
+import asyncio
+from datetime import date
+
+import database
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# days since the Unix epoch, shifted onto the proleptic Gregorian ordinal
+_TO_ORDINAL = [{"$set": {"date": {"$toInt": {"$add": [
+    {"$floor": {"$divide": [{"$toLong": "$date"}, 86400000]}},
+    _EPOCH_ORDINAL,
+]}}}}]
+
+async def migrate():
+    db, _ = database.connect()
+    if db is None:
+        raise SystemExit("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    for name in ("academiccalendar", "teacherleave", "attendancerecord"):
+        result = await db[name].update_many({"date": {"$type": "date"}}, _TO_ORDINAL)
+        print(f"{name}: {result.modified_count} documents migrated")
+    await database.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
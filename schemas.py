@@ -2,11 +2,12 @@
 Database Schemas for Attendance App
 
 Each Pydantic model corresponds to a MongoDB collection (lowercased class name).
+Calendar dates are stored as `date.toordinal()` integers.
 """
 from __future__ import annotations
 from typing import Optional, List, Literal
 from pydantic import BaseModel, Field, EmailStr
-from datetime import date, datetime
+from datetime import datetime
 
 # Users
 class Student(BaseModel):
@@ -31,12 +32,12 @@ class SemesterSubjects(BaseModel):
 
 class AcademicCalendar(BaseModel):
     title: str
-    date: date
+    date: int
     type: Literal["holiday", "event", "semester_start", "semester_end"] = "holiday"
 
 class TeacherLeave(BaseModel):
     subject_code: str
-    date: date
+    date: int
     reason: Optional[str] = None
 
 class OTP(BaseModel):
@@ -48,7 +49,7 @@ class OTP(BaseModel):
 class AttendanceRecord(BaseModel):
     student_id: str
     subject_code: str
-    date: date
+    date: int
     sessions_held: int = 1
     attended_count: int = 0
     status: Literal["attended", "not_attended", "teacher_leave", "holiday", "mixed"] = "mixed"